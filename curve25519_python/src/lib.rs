@@ -1,7 +1,25 @@
 use pyo3::prelude::*;
 use curve25519_dalek::scalar::Scalar;
-use curve25519_dalek::edwards::{CompressedEdwardsY};
+use curve25519_dalek::edwards::{CompressedEdwardsY, EdwardsPoint, VartimeEdwardsPrecomputation};
 use curve25519_dalek::constants::ED25519_BASEPOINT_POINT;
+use curve25519_dalek::traits::{MultiscalarMul, VartimeMultiscalarMul, VartimePrecomputedMultiscalarMul};
+
+fn unpack_scalars(buf: &[u8]) -> PyResult<Vec<Scalar>> {
+    if buf.len() % 32 != 0 {
+        return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>("Scalars must be packed 32-byte values"));
+    }
+    Ok(buf.chunks_exact(32).map(|c| Scalar::from_bytes_mod_order(c.try_into().unwrap())).collect())
+}
+fn unpack_points(buf: &[u8]) -> PyResult<Vec<EdwardsPoint>> {
+    if buf.len() % 32 != 0 {
+        return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>("Points must be packed 32-byte values"));
+    }
+    buf.chunks_exact(32)
+        .map(|c| CompressedEdwardsY(c.try_into().unwrap())
+            .decompress()
+            .ok_or_else(|| PyErr::new::<pyo3::exceptions::PyValueError, _>("Invalid point")))
+        .collect()
+}
 
 #[pyfunction]
 fn scalar_exp(a: &[u8], x: u64) -> PyResult<Vec<u8>> {
@@ -112,6 +130,46 @@ fn point_subtraction(point1_bytes: &[u8], point2_bytes: &[u8]) -> PyResult<Vec<u
     let diff_point = point1 + neg_point2;
     Ok(diff_point.compress().to_bytes().to_vec())
 }
+#[pyfunction]
+fn multiscalar_multiply(scalars_bytes: &[u8], points_bytes: &[u8]) -> PyResult<Vec<u8>> {
+    let scalars = unpack_scalars(scalars_bytes)?;
+    let points = unpack_points(points_bytes)?;
+    if scalars.len() != points.len() {
+        return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>("Scalar and point counts differ"));
+    }
+    let result_point = EdwardsPoint::vartime_multiscalar_mul(scalars.iter(), points.iter());
+    Ok(result_point.compress().to_bytes().to_vec())
+}
+#[pyfunction]
+fn multiscalar_multiply_many(rows_bytes: &[u8], points_bytes: &[u8]) -> PyResult<Vec<u8>> {
+    // One precomputed table over the shared bases, reused for every row of scalars.
+    let points = unpack_points(points_bytes)?;
+    let scalars = unpack_scalars(rows_bytes)?;
+    if points.is_empty() || scalars.len() % points.len() != 0 {
+        return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>("Rows must have one scalar per point"));
+    }
+    let table = VartimeEdwardsPrecomputation::new(points.iter());
+    let mut out = Vec::with_capacity(scalars.len() / points.len() * 32);
+    for row in scalars.chunks_exact(points.len()) {
+        out.extend_from_slice(&table.vartime_multiscalar_mul(row.iter()).compress().to_bytes());
+    }
+    Ok(out)
+}
+#[pyfunction]
+fn multiscalar_multiply_many_ct(rows_bytes: &[u8], points_bytes: &[u8]) -> PyResult<Vec<u8>> {
+    // Constant-time counterpart of multiscalar_multiply_many for secret scalars: no shared
+    // vartime table, each row is its own constant-time multiscalar multiplication.
+    let points = unpack_points(points_bytes)?;
+    let scalars = unpack_scalars(rows_bytes)?;
+    if points.is_empty() || scalars.len() % points.len() != 0 {
+        return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>("Rows must have one scalar per point"));
+    }
+    let mut out = Vec::with_capacity(scalars.len() / points.len() * 32);
+    for row in scalars.chunks_exact(points.len()) {
+        out.extend_from_slice(&EdwardsPoint::multiscalar_mul(row.iter(), points.iter()).compress().to_bytes());
+    }
+    Ok(out)
+}
 #[pymodule]
 fn curve25519_python<'py>(_py: Python<'py>, m: &Bound<'py, PyModule>) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(scalar_exp, m)?)?;
@@ -123,5 +181,8 @@ fn curve25519_python<'py>(_py: Python<'py>, m: &Bound<'py, PyModule>) -> PyResul
     m.add_function(wrap_pyfunction!(scalar_inverse, m)?)?;
     m.add_function(wrap_pyfunction!(point_addition, m)?)?;
     m.add_function(wrap_pyfunction!(point_subtraction, m)?)?;
+    m.add_function(wrap_pyfunction!(multiscalar_multiply, m)?)?;
+    m.add_function(wrap_pyfunction!(multiscalar_multiply_many, m)?)?;
+    m.add_function(wrap_pyfunction!(multiscalar_multiply_many_ct, m)?)?;
     Ok(())
 }
\ No newline at end of file
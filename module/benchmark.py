@@ -6,17 +6,26 @@ Implements TSS-PV Ver 1.0 with ElGamal encryption for dummy shares.
 Fixes TrVer and ShD to correctly check cm consistency using T[i][7].
 """
 
-import time, random
-from utils import reset, rb_reset, banner, rand, CNT, RB_CNT
-from curve_ops import rho, Sm, cm, B
-from poly_helpers import gpoly, hp, proof
-from elgamal import elgamal_encrypt, Pm
-from verification import ShD, ShS
+import sys, time, random, contextlib
+import utils
+from utils import reset, rb_reset, banner, rand, unpack, CNT, RB_CNT
+from curve_ops import B
+from poly_helpers import gpoly, hp, hp_many
+from elgamal import Pm
+from verification import ShD, ShS, TranscriptIndex
 from trace import Trace, TrVer, Rbox
-from reconstruction import recon
+from reconstruction import recon, ReconstructionSession, lagrange_loop, lagrange_tree, LAGRANGE_TREE_MIN
+from dealer import Dealing, deal_pipeline
 
-def run(n, k, f):
+def run(n, k, f, seed=None):
     assert 0 < f < k - 1
+    if seed is not None:  # reproducible run: seeded rand() and sampling, both restored after
+        with utils.seeded(seed):
+            random.seed(seed)
+            try:
+                return run(n, k, f)
+            finally:
+                random.seed()
     print(f"\n== n={n} k={k} f={f} ==")
     g = gpoly(k - 1)
     xs = [(i + 1).to_bytes(32, 'little') for i in range(n)]
@@ -25,15 +34,13 @@ def run(n, k, f):
     # Player share generation
     reset()
     t0 = time.perf_counter()
-    fx = [hp(x, g) for x in xs]
-    fz = [hp(z, g) for z in zs]
+    fx = unpack(hp_many(xs, g))
+    fz = unpack(hp_many(zs, g, secret=True))
     print(f"[share ] {1e3*(time.perf_counter()-t0)/n:7.1f} ms {CNT//n:3d} mul/ply")
     banner()
 
     # Dealer operations
     r, s = rand(), rand()
-    S = Sm(s)
-    cm_ = cm(r, s)
 
     # Generate ElGamal key pair for dealer
     sk = rand()
@@ -41,23 +48,10 @@ def run(n, k, f):
     reset()
     t0 = time.perf_counter()
 
-    px, pz, T = [], [], []
-    dsh = []
-    for i in range(n):
-        # Party share
-        px_i = rho(fx[i], r, s)  # fx_i^r * S
-        π_i = proof(fx[i], px_i, cm_, r, s)
-        # Dummy share
-        pz_i = rho(fz[i], r, s)  # fz_i^r * S
-        ct_i = elgamal_encrypt(fz[i], pk, sk)  # (c1, c2, sk)
-        πp_i = proof(fz[i], pz_i, cm_, r, s)
-        T.append((fx[i], fz[i], px_i, pz_i, π_i, πp_i, ct_i[:2], cm_))  # Include cm_
-        px.append(px_i)
-        pz.append(pz_i)
-        dsh.append((zs[i], pz_i))
-        
-    # Ensure shv uses exact px from T
-    shv = [(xs[i], T[i][2]) for i in range(n)]  # Explicitly take px_i from T
+    D = Dealing(g, r, s, pk, sk)
+    S, cm_ = D.S, D.cm_
+    deal_pipeline(zip(xs, zs, fx, fz), g, r, s, D.add_row, pk, sk, S=S, cm_=cm_)
+    T, dsh, shv = D.T, D.dsh, D.shv
     print(f"[dealer] {1e3*(time.perf_counter()-t0):7.1f} ms {CNT:4d} mul")
     banner()
 
@@ -71,7 +65,8 @@ def run(n, k, f):
     # VerifySS
     reset()
     t0 = time.perf_counter()
-    allok = all(ShS(sh, T, g) for sh in shv[:k])
+    ix = TranscriptIndex(T)
+    allok = all(ShS(sh, T, g, ix) for sh in shv[:k])
     print(f"[ShS ] {1e3*(time.perf_counter()-t0):7.1f} ms {CNT//k:3d} mul all={allok}")
     banner()
 
@@ -86,6 +81,16 @@ def run(n, k, f):
     print(f"[Recon ] {1e3*(time.perf_counter()-t0):7.1f} ms {CNT:4d} mul ok={ok}")
     banner()
 
+    # Online reconstruction, shares arriving one at a time
+    reset()
+    t0 = time.perf_counter()
+    session = ReconstructionSession(k, T, g, ix)
+    for sh in shv:
+        if session.add(sh) is not None:
+            break
+    print(f"[Online] {1e3*(time.perf_counter()-t0):7.1f} ms {utils.CNT:4d} mul ok={session.secret == secret}")
+    banner()
+
     # Trace
     tk = ((r, s, S), dsh, shv)
     rb_before, c_before, t0 = RB_CNT, CNT, time.perf_counter()
@@ -105,11 +110,45 @@ def run(n, k, f):
     print(f"[TrVer ] {trv_ms:7.1f} ms {trv_mul:4d} mul ok={ok}")
     banner()
 
+def crossover(ns, ratio=2):
+    # hp evaluation at n points, k = n/ratio: naive vs shared-table MSM, outputs must agree
+    for n in ns:
+        k = n // ratio + 1
+        g = gpoly(k - 1)
+        xs = [rand() for _ in range(n)]
+        print(f"\n== hp crossover n={n} k={k} ==")
+        outs = []
+        for name, fn in (("hp", lambda: b''.join(hp(x, g) for x in xs)),
+                         ("hp_many", lambda: hp_many(xs, g))):
+            reset()
+            t0 = time.perf_counter()
+            outs.append(fn())
+            print(f"[{name:7s}] {1e3*(time.perf_counter()-t0):9.1f} ms {utils.CNT:8d} mul")
+        assert outs[0] == outs[1], f"hp_many disagrees with hp at n={n}"
+
+def lagrange_crossover(ks):
+    # Lagrange coefficients at k random x: double loop vs remainder tree, outputs must agree
+    for k in ks:
+        xs = [rand() for _ in range(k)]
+        print(f"\n== lagrange crossover k={k} ==")
+        outs = []
+        for name, fn in (("loop", lagrange_loop), ("tree", lagrange_tree)):
+            t0 = time.perf_counter()
+            outs.append(fn(xs))
+            print(f"[{name:7s}] {1e3*(time.perf_counter()-t0):9.1f} ms")
+        assert outs[0] == outs[1], f"lagrange_tree disagrees with the double loop at k={k}"
+
 if __name__ == "__main__":
+    seed = int(sys.argv[sys.argv.index("--seed") + 1]) if "--seed" in sys.argv else None
+    if "crossover" in sys.argv[1:]:
+        with utils.seeded(seed) if seed is not None else contextlib.nullcontext():
+            crossover([64, 256, 1024, 2048, 4096, 8192])
+            lagrange_crossover([LAGRANGE_TREE_MIN, 1024, 4096])
+        sys.exit()
     for n, k, f in [
         (32, 17, 11),
         (64, 33, 22), (128, 65, 43),
         (256, 129, 86)
         # (8, 5, 2)
         ]:
-        run(n, k, f)
+        run(n, k, f, seed)
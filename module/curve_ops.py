@@ -3,10 +3,14 @@ from utils import E, bump, rand
 
 B = b'\x58' + b'\x66'*31
 ONE = b'\x01' + b'\0'*31
+ZERO = b'\0'*32
 
 def P(A, B):
     return E(cp.point_addition(A, B))
 
+def Ps(A, B):
+    return E(cp.point_subtraction(A, B))
+
 def Pm(s, P_):
     bump()
     return E(cp.point_multiply(s, P_))
@@ -15,12 +19,27 @@ def Sm(s):
     bump()
     return E(cp.scalar_multiply(s))
 
+def Msm(ss, Ps):
+    bump(len(Ps) // 32)
+    return E(cp.multiscalar_multiply(ss, Ps))
+
+def MsmMany(rows, Ps):
+    bump(len(rows) // 32)  # one table over Ps, shared by every row
+    return E(cp.multiscalar_multiply_many(rows, Ps))
+
+def MsmManyCT(rows, Ps):
+    bump(len(rows) // 32)  # constant time, for secret scalars; no shared vartime table
+    return E(cp.multiscalar_multiply_many_ct(rows, Ps))
+
 def S2(a, b):
     return E(cp.scalar_multiply_scalar(a, b))
 
 def Inv(z):
     return E(cp.scalar_inverse(z))
 
+def Add(a, b):
+    return E(cp.scalar_addition(a, b))
+
 def Sub(a, b):
     return E(cp.scalar_subtraction(a, b))
 
@@ -0,0 +1,436 @@
+import threading, queue, hashlib, struct, os
+from collections import deque, namedtuple
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from curve_ops import Pm, P, Sm, cm, rand
+from poly_helpers import hp_many, proof, gdigest, RefillPool
+from elgamal import elgamal_encrypt
+from utils import unpack, substream, use_stream
+
+# A packed row holds only the public T columns. The abscissas (x, z) are kept apart:
+# z is the secret half of a dummy share (z, pz), so it never goes into a transcript
+# or distribution stream, only into the tracer's key file.
+ROW_SIZE = 12 * 32  # fx | fz | px | pz | π (3) | πp (3) | ct (2, zeros if none)
+KEY_SIZE = 2 * 32   # x | z
+
+def pack_row(row):
+    fx_i, fz_i, px_i, pz_i, π_i, πp_i, ct_i, _ = row
+    return b''.join([fx_i, fz_i, px_i, pz_i, *π_i, *πp_i, *(ct_i or (b'\0' * 32,) * 2)])
+
+def unpack_row(buf, cm_):
+    v = unpack(bytes(buf))
+    ct_i = (v[10], v[11]) if any(buf[10*32:]) else ()
+    return v[0], v[1], v[2], v[3], tuple(v[4:7]), tuple(v[7:10]), ct_i, cm_
+
+def deal_row(fx_i, fz_i, r, s, S, cm_, pk=None, sk=None, nonces=None):
+    # One transcript row; rho(h, r, s) = r*h + S, so px/pz cost one mul each
+    px_i = P(Pm(r, fx_i), S)
+    π_i = proof(fx_i, px_i, cm_, r, s, nonces)
+    pz_i = P(Pm(r, fz_i), S)
+    ct_i = elgamal_encrypt(fz_i, pk, sk)[:2] if pk else ()
+    πp_i = proof(fz_i, pz_i, cm_, r, s, nonces)
+    return (fx_i, fz_i, px_i, pz_i, π_i, πp_i, ct_i, cm_)
+
+class Dealing:
+    """One dealt secret (r, s) over g: transcript T, dummy shares dsh and player shares shv."""
+    def __init__(self, g, r, s, pk=None, sk=None, nonces=None):
+        self.g, self.r, self.s, self.pk, self.sk, self.nonces = g, r, s, pk, sk, nonces
+        self.S, self.cm_ = Sm(s), cm(r, s)
+        self.T, self.dsh, self.shv = [], [], []
+
+    @property
+    def tk(self):
+        return (self.r, self.s, self.S), self.dsh, self.shv
+
+    def add_row(self, x, z, row):
+        self.T.append(row)
+        self.shv.append((x, row[2]))
+        self.dsh.append((z, row[3]))
+
+    def add_rows(self, xs, zs, fx, fz):
+        for x, z, fx_i, fz_i in zip(xs, zs, fx, fz):
+            self.add_row(x, z, deal_row(fx_i, fz_i, self.r, self.s, self.S, self.cm_,
+                                           self.pk, self.sk, self.nonces))
+        return self
+
+def deal_many(secrets, xs, g, pk=None, sk=None, zs=None, nonces=None, dummies=None):
+    # hp columns for players and dummies are computed once; each (r, s) in secrets
+    # then costs O(n) muls (rho, proofs, ElGamal) and is yielded as soon as it is done.
+    # With dummies (a DummySharePool over g) the dummy column comes precomputed.
+    if dummies is not None:
+        zs, fz = dummies.take(len(xs))
+    else:
+        zs = zs or [rand() for _ in xs]
+        fz = unpack(hp_many(zs, g, secret=True))
+    fx = unpack(hp_many(xs, g))
+    for r, s in secrets:
+        yield Dealing(g, r, s, pk, sk, nonces).add_rows(xs, zs, fx, fz)
+
+_SHM_COLS = (KEY_SIZE + ROW_SIZE) // 32  # x, z, then the packed row
+
+def _deal_shard(name, n, lo, xs, zs, g, r, s, S, cm_, pk, sk, fz=None, rng=None):
+    # Deal rows lo.. straight into the shared columnar block: column c of row i at (c*n + i)*32
+    use_stream(rng)
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        fx, fz = unpack(hp_many(xs, g)), fz or unpack(hp_many(zs, g, secret=True))
+        for i, (x, z, fx_i, fz_i) in enumerate(zip(xs, zs, fx, fz), lo):
+            row = x + z + pack_row(deal_row(fx_i, fz_i, r, s, S, cm_, pk, sk))
+            for c in range(_SHM_COLS):
+                shm.buf[(c*n + i)*32:(c*n + i + 1)*32] = row[32*c:32*c + 32]
+    finally:
+        shm.close()
+
+def deal(xs, g, r, s, pk=None, sk=None, zs=None, workers=1, nonces=None, dummies=None):
+    # nonces (a NoncePool) is used in-process only; shard workers draw their own
+    if workers <= 1:
+        return next(deal_many([(r, s)], xs, g, pk, sk, zs, nonces, dummies))
+    # Shard player ranges over processes; rows never travel back pickled, they are
+    # read out of shared memory in one copy
+    n = len(xs)
+    zs, fz = dummies.take(n) if dummies is not None else (zs or [rand() for _ in xs], None)
+    D = Dealing(g, r, s, pk, sk)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, n * 32 * _SHM_COLS))
+    try:
+        step = -(-n // (4 * workers)) or 1
+        with ProcessPoolExecutor(workers) as ex:
+            futs = [ex.submit(_deal_shard, shm.name, n, lo, xs[lo:lo+step], zs[lo:lo+step],
+                              g, r, s, D.S, D.cm_, pk, sk, fz and fz[lo:lo+step], substream(f'deal{lo}'))
+                    for lo in range(0, n, step)]
+            for fut in futs:
+                fut.result()
+        buf = bytes(shm.buf[:n * 32 * _SHM_COLS])
+    finally:
+        shm.close()
+        shm.unlink()
+    col = lambda c, i: buf[(c*n + i)*32:(c*n + i + 1)*32]
+    for i in range(n):
+        v = [col(c, i) for c in range(_SHM_COLS)]
+        D.add_row(v[0], v[1], (v[2], v[3], v[4], v[5], tuple(v[6:9]), tuple(v[9:12]),
+                               (v[12], v[13]) if pk else (), D.cm_))
+    return D
+
+def extend_dealing(state, new_xs, zs=None):
+    # Append rows for new players only (rows are independent given r, s, g, cm_);
+    # returns the new rows, which ShD(rows, state.cm_) validates on their own
+    have = {x for x, _ in state.shv}
+    if len(set(new_xs)) != len(new_xs):
+        raise ValueError("duplicate player in new_xs")
+    if any(x in have for x in new_xs):
+        raise ValueError("player already dealt")
+    zs = zs or [rand() for _ in new_xs]
+    if len(zs) != len(new_xs):
+        raise ValueError("need one z per new player")
+    have.update(new_xs)
+    if any(z in have for z in zs):
+        raise ValueError("dummy share z collides with a player x")
+    lo = len(state.T)
+    state.add_rows(new_xs, zs, unpack(hp_many(new_xs, state.g)), unpack(hp_many(zs, state.g, secret=True)))
+    return state.T[lo:]
+
+# ────────── Dummy-share pool ──────────
+# Dummy shares (z, hp(z, g)) do not depend on the secret, so for a fixed g they are made
+# ahead of time. Pool file := magic (8) | gdigest(g) (32) | consumed:u64 | 64-byte z || fz
+# records; consumed is advanced before pairs are handed out, so no pair is dealt twice.
+POOL_MAGIC = b'TSSPVD1\0'
+POOL_HEADER = struct.Struct('>8s32sQ')
+
+def _dummy_batch(g, m, rng=None):
+    if rng is not None:
+        use_stream(rng)
+    zs = [rand() for _ in range(m)]
+    return zs, unpack(hp_many(zs, g, secret=True))
+
+class DummySharePool(RefillPool):
+    """(z, hp(z, g)) pairs for a fixed g, optionally kept on disk; see RefillPool.
+
+    With an executor (e.g. a ProcessPoolExecutor) the hp work of a refill runs there."""
+    def __init__(self, g, path=None, size=4096, low=1024, batch=256, executor=None, start=True):
+        super().__init__(size, low, batch, start=False)
+        self.g, self.path, self.executor = g, path, executor
+        self.fh, self.used, self.batches = None, 0, 0
+        self.digest = gdigest(g)
+        if path is not None:
+            self._open()
+        if start:
+            self.start()
+
+    def _open(self):
+        # load unconsumed pairs, then rewrite the file with just those (consumed = 0)
+        digest = self.digest
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as fh:
+                magic, gd, used = POOL_HEADER.unpack(fh.read(POOL_HEADER.size))
+                if magic != POOL_MAGIC or gd != digest:
+                    raise ValueError("dummy pool file is for another g")
+                fh.seek(POOL_HEADER.size + 64 * used)
+                # a short tail is an append cut off by a crash; it is dropped by the rewrite below
+                while len(rec := fh.read(64)) == 64:
+                    self.items.append((rec[:32], rec[32:]))
+        tmp = self.path + '.tmp'
+        # the records hold every z in the clear, so the file is owner-only like the key file
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as fh:
+            fh.write(POOL_HEADER.pack(POOL_MAGIC, digest, 0))
+            fh.writelines(z + f for z, f in self.items)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.path)
+        self.fh = open(self.path, 'r+b')
+        self.fh.seek(0, os.SEEK_END)
+
+    def _make(self, m):
+        if isinstance(self.executor, ProcessPoolExecutor):
+            self.batches += 1
+            zs, fz = self.executor.submit(_dummy_batch, self.g, m, substream(f'dummy{self.batches}')).result()
+        elif self.executor is not None:
+            zs, fz = self.executor.submit(_dummy_batch, self.g, m).result()
+        else:
+            zs, fz = _dummy_batch(self.g, m)
+        return list(zip(zs, fz))
+
+    def _add(self, items):
+        with self.cv:
+            if self.fh is not None:
+                self.fh.seek(0, os.SEEK_END)
+                self.fh.writelines(z + f for z, f in items)
+                self.fh.flush()
+            super()._add(items)
+
+    def _consumed(self, k):
+        # advance the on-disk consumed count before the pairs are handed out
+        if self.fh is not None:
+            self.used += k
+            self.fh.seek(0)
+            self.fh.write(POOL_HEADER.pack(POOL_MAGIC, self.digest, self.used))
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+
+    def take(self, n):
+        # (zs, fz) columns of n pairs; any shortfall is computed inline
+        got = self._pop(n)
+        zs, fz = [z for z, _ in got], [f for _, f in got]
+        if len(got) < n:
+            more = _dummy_batch(self.g, n - len(got))
+            zs, fz = zs + more[0], fz + more[1]
+        return zs, fz
+
+    def close(self):
+        super().close()
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+# ────────── Pipelined dealer ──────────
+# Work items are chunks of [x, z, fx, fz, px, pz, π, πp, ct] rows.
+def _st_hp(g, chunk):
+    # fill whichever of fx (slot 2, from public x) and fz (slot 3, from secret z) is missing
+    for i in (2, 3):
+        todo = [c for c in chunk if c[i] is None]
+        if todo:
+            for c, f in zip(todo, unpack(hp_many([c[i - 2] for c in todo], g, secret=i == 3))):
+                c[i] = f
+    return chunk
+
+def _st_rho(r, S, chunk):
+    for c in chunk:
+        c[4], c[5] = P(Pm(r, c[2]), S), P(Pm(r, c[3]), S)
+    return chunk
+
+def _st_proof(cm_, r, s, nonces, chunk):
+    for c in chunk:
+        c[6], c[7] = proof(c[2], c[4], cm_, r, s, nonces), proof(c[3], c[5], cm_, r, s, nonces)
+    return chunk
+
+def _st_enc(pk, sk, chunk):
+    for c in chunk:
+        c[8] = elgamal_encrypt(c[3], pk, sk)[:2] if pk else ()
+    return chunk
+
+_DONE = object()
+
+def _stage(fn, inq, outq, errs, pool=None, depth=4, stop=None):
+    # Thread moving chunks inq -> fn -> outq in order; with a pool, up to `depth` chunks run at once.
+    # Once stop is set (by any failure) inputs are dropped; after its own failure the stage
+    # drains inq to _DONE, so no upstream thread stays blocked on a full queue.
+    stop = stop or threading.Event()
+    def run():
+        pending, item = deque(), None
+        try:
+            while (item := inq.get()) is not _DONE:
+                if stop.is_set():
+                    continue
+                if pool is None:
+                    outq.put(fn(item))
+                    continue
+                pending.append(pool.submit(fn, item))
+                while pending and (len(pending) >= depth or pending[0].done()):
+                    outq.put(pending.popleft().result())
+            for fut in pending:
+                outq.put(fut.result())
+        except BaseException as e:
+            errs.append(e)
+            stop.set()
+            for fut in pending:
+                fut.cancel()
+            while item is not _DONE:
+                item = inq.get()
+        outq.put(_DONE)
+    th = threading.Thread(target=run, daemon=True)
+    th.start()
+    return th
+
+def deal_pipeline(players, g, r, s, sink, pk=None, sk=None, chunk=8, maxsize=4, pools=None,
+                  nonces=None, dummies=None, S=None, cm_=None):
+    # Deal as hp -> rho -> proof -> encrypt stages joined by bounded queues; each finished
+    # row goes to sink(x, z, row) at once, so memory is O(chunk * maxsize), not O(n).
+    # players yields x, or (x, z, fx, fz) when the hp columns are already known;
+    # pools maps a stage name ('hp', 'rho', 'proof', 'enc') to an executor; nonces (a
+    # NoncePool) needs an in-process 'proof' stage, i.e. no pool or a thread pool;
+    # dummies (a DummySharePool over g) supplies (z, fz) for players given as bare x;
+    # S = s*B and cm_ = cm(r, s) are computed here unless the caller (e.g. a Dealing) has them.
+    pools = pools or {}
+    S = S or Sm(s)
+    cm_ = cm_ or cm(r, s)
+    fns = [('hp', partial(_st_hp, g)), ('rho', partial(_st_rho, r, S)),
+           ('proof', partial(_st_proof, cm_, r, s, nonces)), ('enc', partial(_st_enc, pk, sk))]
+    qs = [queue.Queue(maxsize) for _ in range(len(fns) + 1)]
+    errs, stop = [], threading.Event()
+    threads = [_stage(fn, qs[i], qs[i+1], errs, pools.get(name), maxsize, stop)
+               for i, (name, fn) in enumerate(fns)]
+
+    def put(buf):
+        if dummies is not None:
+            todo = [c for c in buf if c[1] is None]
+            for c, z, fz_i in zip(todo, *dummies.take(len(todo))):
+                c[1], c[3] = z, fz_i
+        qs[0].put(buf)
+
+    def feed():
+        buf = []
+        try:
+            for p in players:
+                if stop.is_set():
+                    return
+                if isinstance(p, bytes):
+                    x, z, fx_i, fz_i = p, None if dummies is not None else rand(), None, None
+                else:
+                    x, z, fx_i, fz_i = (tuple(p) + (None, None))[:4]
+                buf.append([x, z, fx_i, fz_i, None, None, None, None, None])
+                if len(buf) == chunk:
+                    put(buf)
+                    buf = []
+            if buf:
+                put(buf)
+        except BaseException as e:
+            errs.append(e)
+            stop.set()
+        finally:
+            qs[0].put(_DONE)
+    threads.append(threading.Thread(target=feed, daemon=True))
+    threads[-1].start()
+
+    count, item = 0, None
+    try:
+        while (item := qs[-1].get()) is not _DONE:
+            if stop.is_set():
+                continue
+            for x, z, fx_i, fz_i, px_i, pz_i, π_i, πp_i, ct_i in item:
+                sink(x, z, (fx_i, fz_i, px_i, pz_i, π_i, πp_i, ct_i, cm_))
+                count += 1
+    except BaseException as e:
+        # sink failed: stop the stages and drain until they have all shut down
+        errs.insert(0, e)
+        stop.set()
+        while item is not _DONE:
+            item = qs[-1].get()
+    for th in threads:
+        th.join()
+    if errs:
+        raise errs[0]
+    return S, cm_, count
+
+def stream_sink(write, key_write=None):
+    # sink writing public packed rows through write (a file's write, a socket's sendall, ...);
+    # the x || z records go to key_write only, and are dropped without one
+    def sink(x, z, row):
+        write(pack_row(row))
+        if key_write is not None:
+            key_write(x + z)
+    return sink
+
+# ────────── On-disk transcript ──────────
+# transcript := magic (8) | row size:u32 | rows:u64 | cm_ (32) | sha256 of all rows (32); rows follow
+# key file   := key magic (8) | rows:u64 | cm_ (32); x || z records follow, mode 0600
+MAGIC = b'TSSPVT2\0'
+HEADER = struct.Struct('>8sIQ32s32s')
+KEY_MAGIC = b'TSSPVK1\0'
+KEY_HEADER = struct.Struct('>8sQ32s')
+TranscriptHandle = namedtuple('TranscriptHandle', 'path header cm_ rows checksum key_path')
+
+def deal_to_file(path, players, g, r, s, pk=None, sk=None, sync_every=1024, chunk=8, dummies=None,
+                 key_path=None):
+    # Stream rows from deal_pipeline to disk, fsync every `sync_every` rows; memory is O(1) in n.
+    # Public rows go to path, the tracer's x || z records to key_path (default path + '.key').
+    key_path = key_path or path + '.key'
+    h, n = hashlib.sha256(), 0
+    with open(path, 'wb') as fh, open(os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as kh:
+        fh.write(b'\0' * HEADER.size)
+        kh.write(b'\0' * KEY_HEADER.size)
+        def sink(x, z, row):
+            nonlocal n
+            rec = pack_row(row)
+            fh.write(rec)
+            kh.write(x + z)
+            h.update(rec)
+            n += 1
+            if n % sync_every == 0:
+                for f in (fh, kh):
+                    f.flush()
+                    os.fsync(f.fileno())
+        S, cm_, _ = deal_pipeline(players, g, r, s, sink, pk, sk, chunk=chunk, dummies=dummies)
+        header = HEADER.pack(MAGIC, ROW_SIZE, n, cm_, h.digest())
+        for f, hd in ((fh, header), (kh, KEY_HEADER.pack(KEY_MAGIC, n, cm_))):
+            f.seek(0)
+            f.write(hd)
+            f.flush()
+            os.fsync(f.fileno())
+    return TranscriptHandle(path, header, cm_, n, h.digest(), key_path)
+
+def read_header(path, verify=False):
+    # the row count must match the file size; verify also re-hashes every row against the header
+    with open(path, 'rb') as fh:
+        magic, size, n, cm_, checksum = HEADER.unpack(fh.read(HEADER.size))
+        if magic != MAGIC or size != ROW_SIZE:
+            raise ValueError("not a TSS-PV transcript")
+        if os.fstat(fh.fileno()).st_size != HEADER.size + n * ROW_SIZE:
+            raise ValueError("transcript size does not match its row count")
+        if verify:
+            h = hashlib.sha256()
+            while blk := fh.read(ROW_SIZE * 1024):
+                h.update(blk)
+            if h.digest() != checksum:
+                raise ValueError("transcript checksum mismatch")
+    key_path = path + '.key' if os.path.exists(path + '.key') else None
+    return TranscriptHandle(path, HEADER.pack(magic, size, n, cm_, checksum), cm_, n, checksum, key_path)
+
+def iter_transcript(path, start=0, verify=True):
+    # public T rows, read one at a time; with verify nothing is yielded before the checksum passes
+    hd = read_header(path, verify)
+    with open(path, 'rb') as fh:
+        fh.seek(HEADER.size + start * ROW_SIZE)
+        for _ in range(start, hd.rows):
+            yield unpack_row(fh.read(ROW_SIZE), hd.cm_)
+
+def iter_keys(key_path, cm_=None, start=0):
+    # tracer-side (x, z) for each row; cm_ checks the key file belongs to that dealing
+    with open(key_path, 'rb') as fh:
+        magic, n, kcm = KEY_HEADER.unpack(fh.read(KEY_HEADER.size))
+        if magic != KEY_MAGIC or (cm_ is not None and kcm != cm_):
+            raise ValueError("not the key file of this transcript")
+        if os.fstat(fh.fileno()).st_size != KEY_HEADER.size + n * KEY_SIZE:
+            raise ValueError("key file size does not match its row count")
+        fh.seek(KEY_HEADER.size + start * KEY_SIZE)
+        for _ in range(start, n):
+            rec = fh.read(KEY_SIZE)
+            yield rec[:32], rec[32:]
@@ -0,0 +1,145 @@
+import asyncio, struct, time, multiprocessing
+
+# Decoder-oracle wire protocol, one length-prefixed frame per batch:
+#   frame    := len:u32 | count:u16 | count * item
+#   query    := qid:u32 | m:u16 | m * (x || y)
+#   response := qid:u32 | ok:u8 | point (zeros when R returned None)
+
+def pack_queries(items):
+    out = [struct.pack('>H', len(items))]
+    for qid, shares in items:
+        out.append(struct.pack('>IH', qid, len(shares)))
+        out.extend(x + y for x, y in shares)
+    body = b''.join(out)
+    return struct.pack('>I', len(body)) + body
+
+def unpack_queries(body):
+    (count,), off, items = struct.unpack_from('>H', body), 2, []
+    for _ in range(count):
+        qid, m = struct.unpack_from('>IH', body, off)
+        off += 6
+        items.append((qid, [(body[off+64*i:off+64*i+32], body[off+64*i+32:off+64*i+64]) for i in range(m)]))
+        off += 64 * m
+    return items
+
+def pack_results(items):
+    body = struct.pack('>H', len(items)) + b''.join(
+        struct.pack('>IB', qid, res is not None) + (res or b'\0' * 32) for qid, res in items)
+    return struct.pack('>I', len(body)) + body
+
+def unpack_results(body):
+    (count,), items = struct.unpack_from('>H', body), []
+    for i in range(count):
+        off = 2 + 37 * i
+        qid, ok = struct.unpack_from('>IB', body, off)
+        items.append((qid, body[off+5:off+37] if ok else None))
+    return items
+
+async def read_frame(reader):
+    (n,) = struct.unpack('>I', await reader.readexactly(4))
+    return await reader.readexactly(n)
+
+# ────────── Local stand-in decoder ──────────
+async def serve(R, host='127.0.0.1', port=0, latency=0.0, ready=None):
+    # Answer batched queries with R; latency emulates a slow external decoder
+    async def one(qid, shares):
+        if latency:
+            await asyncio.sleep(latency)
+        return qid, R(shares)
+
+    async def respond(items, writer):
+        writer.write(pack_results(await asyncio.gather(*(one(q, s) for q, s in items))))
+        await writer.drain()
+
+    async def handle(reader, writer):
+        tasks = set()
+        try:
+            while True:
+                task = asyncio.create_task(respond(unpack_queries(await read_frame(reader)), writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    if ready is not None:
+        ready(server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+def _decoder_main(R, host, latency, conn):
+    asyncio.run(serve(R, host, latency=latency, ready=conn.send))
+
+def spawn_decoder(R, host='127.0.0.1', latency=0.0):
+    """Run R (e.g. an Rbox) as a decoder process on a local socket; returns (process, port)."""
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=_decoder_main, args=(R, host, latency, child), daemon=True)
+    proc.start()
+    return proc, parent.recv()
+
+# ────────── Pipelining client ──────────
+class DecoderClient:
+    """asyncio client: at most `window` queries in flight, coalesced into frames of up to `batch`."""
+    def __init__(self, host, port, window=64, batch=32):
+        self.host, self.port, self.batch = host, port, batch
+        self.window = asyncio.Semaphore(window)
+        self.pending, self.queue, self.latency = {}, [], []
+        self.qid, self.flushing = 0, False
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.rx = asyncio.create_task(self._recv())
+        return self
+
+    async def _recv(self):
+        # whatever ends the loop (EOF, a bad frame, close()), queries still in flight fail
+        why = "connection closed"
+        try:
+            while True:
+                for qid, res in unpack_results(await read_frame(self.reader)):
+                    fut, t0 = self.pending.pop(qid, (None, None))
+                    if fut is None:
+                        continue
+                    self.latency.append(time.perf_counter() - t0)
+                    if not fut.done():
+                        fut.set_result(res)
+        except Exception as e:
+            why = repr(e)
+        finally:
+            for fut, _ in self.pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError(f"decoder closed: {why}"))
+            self.pending.clear()
+
+    def _flush(self):
+        # everything queued in this loop iteration goes out together
+        self.flushing = False
+        q, self.queue = self.queue, []
+        for i in range(0, len(q), self.batch):
+            self.writer.write(pack_queries(q[i:i+self.batch]))
+
+    async def query(self, shares):
+        async with self.window:
+            self.qid += 1
+            fut = asyncio.get_running_loop().create_future()
+            self.pending[self.qid] = (fut, time.perf_counter())
+            self.queue.append((self.qid, list(shares)))
+            if not self.flushing:
+                self.flushing = True
+                asyncio.get_running_loop().call_soon(self._flush)
+            return await fut
+
+    def stats(self):
+        lat = sorted(self.latency)
+        if not lat:
+            return dict(queries=0)
+        return dict(queries=len(lat), mean_ms=1e3 * sum(lat) / len(lat),
+                    p50_ms=1e3 * lat[len(lat) // 2], p99_ms=1e3 * lat[min(len(lat) - 1, len(lat) * 99 // 100)])
+
+    async def close(self):
+        self.writer.close()
+        self.rx.cancel()
+        await asyncio.gather(self.rx, return_exceptions=True)
@@ -1,7 +1,16 @@
-import hashlib
-from curve_ops import ONE, Pm, P, S2, Inv, Sub, Sm, rand, H1, H2, B
+import hashlib, threading
+from collections import OrderedDict, deque
+from curve_ops import ONE, ZERO, Pm, P, S2, Inv, Add, Sub, Sm, MsmMany, MsmManyCT, rand, H1, H2, B
 from utils import E, bump
 
+KARATSUBA_CUT = 32      # schoolbook / single MSM below this length
+# Scalar poly_rem uses long division for quotients shorter than NEWTON_MIN and Newton
+# (Karatsuba products, no FFT since the 2-adicity of l is 2) from there. Newton only pays
+# from quotient ~1-2k on (scalar ops for d = m = 1024: 2.19M Newton, 2.10M long), so a
+# remainder tree is Θ(k^2) up to k ~ 2048 and O(k^1.585 log k) only beyond.
+NEWTON_MIN = 2048
+HP_CACHE_SIZE = 1 << 14
+
 def gpoly(t):
     return [Sm(rand()) for _ in range(t)]
 
@@ -12,10 +21,251 @@ def hp(x, g):
         xp = S2(xp, x)
     return acc  # (k-1) muls
 
-def proof(h, p, cm_, r, s):
+class LRU:
+    """Bounded, thread-safe LRU map with hit/miss/eviction counters."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, make):
+        with self.lock:
+            if key in self.data:
+                self.hits += 1
+                self.data.move_to_end(key)
+                return self.data[key]
+            self.misses += 1
+        val = make()  # computed outside the lock
+        with self.lock:
+            self.data[key] = val
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+        return val
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    size=len(self.data), maxsize=self.maxsize,
+                    hit_rate=self.hits / max(1, self.hits + self.misses))
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k != 'lock'}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, lock=threading.Lock())
+
+HP_CACHE = LRU(HP_CACHE_SIZE)
+
+def gdigest(g):
+    return hashlib.sha256(b''.join(g)).digest()
+
+def hp_cached(x, g, cache=HP_CACHE):
+    return cache.get((gdigest(g), x), lambda: hp(x, g))
+
+def powers(x, m):
+    out, xp = [], x
+    for _ in range(m):
+        out.append(xp)
+        xp = S2(xp, x)
+    return out  # x, x^2, ..., x^m
+
+def hp_many(xs, g, secret=False):
+    # Packed hp(x, g) for every x: one power matrix, one table over g. The shared table is
+    # variable time, so it is for public x (player IDs) only; secret=True (dummy z) goes
+    # through the constant-time MSM instead
+    if not g:
+        return ONE * len(xs)
+    rows = b''.join(b''.join(powers(x, len(g))) for x in xs)
+    return (MsmManyCT if secret else MsmMany)(rows, b''.join(g))  # n*(k-1) muls
+
+# ────────── Scalar / point polynomials (low degree first) ──────────
+def _school(a, b):
+    out = [ZERO] * (len(a) + len(b) - 1)
+    for i, u in enumerate(a):
+        for j, v in enumerate(b):
+            out[i+j] = Add(out[i+j], S2(u, v))
+    return out
+
+def _karatsuba(a, b):
+    n = max(len(a), len(b))
+    if n <= KARATSUBA_CUT:
+        return _school(a, b)
+    la, lb, h = len(a), len(b), n // 2
+    a = a + [ZERO] * (n - la)
+    b = b + [ZERO] * (n - lb)
+    z0 = _karatsuba(a[:h], b[:h])
+    z2 = _karatsuba(a[h:], b[h:])
+    z1 = _karatsuba([Add(u, v) for u, v in zip(a[:h], a[h:])] + a[2*h:],
+                    [Add(u, v) for u, v in zip(b[:h], b[h:])] + b[2*h:])
+    z1 = [Sub(Sub(v, z0[i]) if i < len(z0) else v, z2[i]) for i, v in enumerate(z1)]
+    out = z0 + [ZERO] * (2*n - 1 - len(z0))
+    for off, z in ((h, z1), (2*h, z2)):
+        for i, v in enumerate(z):
+            out[off+i] = Add(out[off+i], v)
+    return out[:la + lb - 1]
+
+def poly_mul(a, b):
+    return _karatsuba(a, b) if a and b else []
+
+def poly_inv(a, m):
+    # a^-1 mod X^m by Newton iteration, a[0] != 0. With a*b = 1 + X^h c mod X^e,
+    # b <- b - X^h (b c mod X^(e-h)): only the new half of b is computed each step
+    b, e = [Inv(a[0])], 1
+    while e < m:
+        h, e = e, min(2 * e, m)
+        c = poly_mul(a[:e], b)[h:e]
+        b = b + [Sub(ZERO, v) for v in poly_mul(b[:e-h], c)[:e-h]]
+    return b
+
+def subproduct_tree(xs):
+    # levels[0] are the (X - x) leaves as (poly, lo, hi); levels[-1] is the root
+    levels = [[([Sub(ZERO, x), ONE], i, i + 1) for i, x in enumerate(xs)]]
+    while len(levels[-1]) > 1:
+        lv = levels[-1]
+        levels.append([(poly_mul(lv[i][0], lv[i+1][0]), lv[i][1], lv[i+1][2]) if i + 1 < len(lv) else lv[i]
+                       for i in range(0, len(lv), 2)])
+    return levels
+
+def poly_rem(G, M):
+    # G mod monic M
+    d = len(M) - 1
+    if len(G) <= d:
+        return G
+    m = len(G) - d
+    if m < NEWTON_MIN:
+        r = list(G)
+        for i in range(len(G) - 1, d - 1, -1):
+            if r[i] != ZERO:
+                for j in range(d):
+                    r[i-d+j] = Sub(r[i-d+j], S2(r[i], M[j]))
+        return r[:d]
+    q = poly_mul(poly_inv(M[::-1], m), G[::-1][:m])[:m][::-1]
+    Mq = poly_mul(M[:d], q)[:d]
+    return [Sub(G[i], Mq[i]) if i < len(Mq) else G[i] for i in range(d)]
+
+def poly_eval_many(G, xs, tree=None):
+    # scalar poly G at every x, reduced down the subproduct tree, Horner at the leaves
+    tree = tree or subproduct_tree(xs)
+    out = [None] * len(xs)
+    stack = [(len(tree) - 1, 0, G)]
+    while stack:
+        lv, j, G = stack.pop()
+        M, lo, hi = tree[lv][j]
+        G = poly_rem(G, M)
+        if lv == 0 or len(G) <= KARATSUBA_CUT:
+            for i in range(lo, hi):
+                acc = ZERO
+                for c in reversed(G):
+                    acc = Add(S2(acc, xs[i]), c)
+                out[i] = acc
+            continue
+        stack.extend((lv - 1, c, G) for c in (2*j, 2*j + 1) if c < len(tree[lv-1]))
+    return out
+
+def nonce():
     kr, ks = rand(), rand()
-    Acm = P(Pm(kr, H1), Pm(ks, H2))
-    Ar = P(Pm(kr, h), Pm(ks, B))
+    return kr, ks, P(Pm(kr, H1), Pm(ks, H2)), Pm(ks, B)
+
+class RefillPool:
+    """Items made ahead of time, refilled in the background.
+
+    A refill thread tops the pool up to `size`, `batch` items at a time, whenever it drops
+    to `low`; subclasses supply _make(m), and a shortfall on draw is made inline and
+    counted as a miss."""
+    def __init__(self, size, low, batch=1, start=True):
+        self.size, self.low, self.batch = size, low, batch
+        self.items = deque()
+        self.cv = threading.Condition()
+        self.drawn = self.misses = self.made = self.refills = 0
+        self.closed = False
+        self.thread = None
+        if start:
+            self.start()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._refill, daemon=True)
+        self.thread.start()
+        return self
+
+    def _make(self, m):
+        raise NotImplementedError
+
+    def _add(self, items):
+        with self.cv:
+            self.items.extend(items)
+            self.made += len(items)
+
+    def _consumed(self, k):
+        # called under the lock once k items have left the pool
+        pass
+
+    def _refill(self):
+        while True:
+            with self.cv:
+                while not self.closed and len(self.items) > self.low:
+                    self.cv.wait()
+                if self.closed:
+                    return
+                self.refills += 1
+                need = self.size - len(self.items)
+            while need > 0 and not self.closed:  # items are made outside the lock
+                m = min(need, self.batch)
+                self._add(self._make(m))
+                need -= m
+
+    def fill(self):
+        # synchronous top-up, e.g. to warm the pool before a dealing
+        while (need := self.size - len(self.items)) > 0:
+            self._add(self._make(min(need, self.batch)))
+        return self
+
+    def _pop(self, n):
+        with self.cv:
+            k = min(n, len(self.items))
+            got = [self.items.popleft() for _ in range(k)]
+            if k:
+                self._consumed(k)
+            self.drawn += n
+            self.misses += n - k
+            if len(self.items) <= self.low:
+                self.cv.notify()
+        return got
+
+    def close(self):
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self):
+        return dict(size=len(self.items), capacity=self.size, low=self.low, drawn=self.drawn,
+                    made=self.made, misses=self.misses, refills=self.refills,
+                    hit_rate=(self.drawn - self.misses) / max(1, self.drawn))
+
+class NoncePool(RefillPool):
+    """Precomputed proof nonces (kr, ks, kr*H1 + ks*H2, ks*B); see RefillPool."""
+    def __init__(self, size=1024, low=256, start=True):
+        super().__init__(size, low, start=start)
+
+    def _make(self, m):
+        return [nonce() for _ in range(m)]
+
+    def draw(self):
+        got = self._pop(1)
+        return got[0] if got else nonce()
+
+def proof(h, p, cm_, r, s, pool=None):
+    # with a pool only kr*h is computed online; the other three muls were done ahead of time
+    kr, ks, Acm, ksB = pool.draw() if pool else nonce()
+    Ar = P(Pm(kr, h), ksB)
     c = hashlib.sha256(b''.join([cm_, p, Acm, Ar])).digest()[:32]
     zr = Sub(kr, S2(c, r))
     zs = Sub(ks, S2(c, s))
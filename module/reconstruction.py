@@ -1,21 +1,249 @@
-import time
+import time, hashlib
 from utils import rb_bump, bump, RB_TIME
-from poly_helpers import montgomery_batch_invert
-from curve_ops import ONE, Pm, P, S2, Inv, Sub, Sm, rand, H1, H2, B
+from poly_helpers import montgomery_batch_invert, subproduct_tree, poly_eval_many, hp_many, LRU
+from verification import ShS, TranscriptIndex
+from curve_ops import ONE, ZERO, S2, Inv, Sub, Msm, MsmMany, rand, H1, H2, B
+from utils import unpack
 
-def recon(shs):
-    acc = Sm(b"\0" * 32)  # ID
-    k = len(shs)
+SMALL_X_MAX = 1 << 16  # closed-form path for player IDs up to this value
+GAP_MAX = 8            # ... with at most this many IDs missing from [min, max]
+# The tree path is a constant-factor win up to k ~ 2048 (see NEWTON_MIN), subquadratic
+# above. Scalar ops, tree / double loop: k=256 182k/197k, 1024 2.59M/3.15M,
+# 2048 9.92M/12.6M, 4096 34.7M/50.3M. `python benchmark.py crossover` times both and
+# checks they agree.
+LAGRANGE_TREE_MIN = 256
+LAGRANGE_CACHE = LRU(256)  # packed coefficient vectors keyed by the sorted x-set
+_FACT, _INV_FACT = [ONE], [ONE]
+
+def _sc(v):
+    return v.to_bytes(32, 'little')
+
+def factorials(m):
+    # i! and 1/i! mod l for i <= m, grown by doubling
+    if len(_FACT) <= m:
+        size = max(m + 1, 2 * len(_FACT))
+        for i in range(len(_FACT), size):
+            _FACT.append(S2(_FACT[-1], _sc(i)))
+        inv = [None] * size
+        inv[-1] = Inv(_FACT[-1])
+        for i in range(size - 1, 0, -1):
+            inv[i-1] = S2(inv[i], _sc(i))
+        _INV_FACT[:] = inv
+    return _FACT, _INV_FACT
+
+def small_ints(xs):
+    if any(len(x) != 32 or x[8:] != b'\0' * 24 for x in xs):
+        return None
+    vs = [int.from_bytes(x[:8], 'little') for x in xs]
+    if not vs or min(vs) < 1 or max(vs) > SMALL_X_MAX or len(set(vs)) != len(vs):
+        return None
+    return vs
+
+def lagrange_consecutive(vs):
+    # IDs in [a, b] minus a few gaps G:
+    # l_j = (∏ S / j) * (-1)^(j-a) / ((j-a)! (b-j)!) * ∏_G (g - j)
+    a, b = min(vs), max(vs)
+    if b - a + 1 - len(vs) > GAP_MAX:
+        return None
+    gaps = sorted(set(range(a, b + 1)) - set(vs))
+    F, IF = factorials(b)
+    prod = S2(F[b], IF[a-1])  # ∏_{m=a..b} m
+    for gp in gaps:
+        prod = S2(prod, S2(F[gp-1], IF[gp]))  # / gp
+    ls = []
+    for j in vs:
+        l = S2(S2(prod, S2(F[j-1], IF[j])), S2(IF[j-a], IF[b-j]))
+        for gp in gaps:
+            l = S2(l, Sub(_sc(gp), _sc(j)))
+        ls.append(Sub(ZERO, l) if (j - a) % 2 else l)
+    return ls  # O(k * (1 + |G|)) scalar ops
+
+def bary_weights(xs, tree=None):
+    # w_j = M'(x_j) = ∏_{m≠j}(x_j - x_m) for M = ∏(X - x_m)
+    if len(xs) < LAGRANGE_TREE_MIN:
+        w = [ONE] * len(xs)
+        for j, xj in enumerate(xs):
+            for m, xm in enumerate(xs):
+                if m != j:
+                    w[j] = S2(w[j], Sub(xj, xm))
+        return w
+    tree = tree or subproduct_tree(xs)
+    M = tree[-1][0][0]
+    return poly_eval_many([S2(_sc(i), c) for i, c in enumerate(M)][1:], xs, tree)
+
+def lagrange_tree(xs):
+    # w_j = M'(x_j) by a remainder tree, then
+    # l_j = ∏_{m≠j} (-x_m) / w_j = -M(0) / (x_j w_j) with one batch inversion
+    tree = subproduct_tree(xs)
+    M = tree[-1][0][0]
+    w = bary_weights(xs, tree)
+    inv = montgomery_batch_invert([S2(x, wj) for x, wj in zip(xs, w)])
+    nM0 = Sub(ZERO, M[0])
+    return [S2(nM0, iv) for iv in inv]
+
+def lagrange(xs):
+    vs = small_ints(xs)
+    if vs is not None:
+        ls = lagrange_consecutive(vs)
+        if ls is not None:
+            return ls
+    if len(xs) >= LAGRANGE_TREE_MIN:
+        return lagrange_tree(xs)
+    return lagrange_loop(xs)
+
+def lagrange_loop(xs):
+    k = len(xs)
     denoms = [ONE] * k
     for j in range(k):
         for m in range(k):
             if m != j:
-                denoms[j] = S2(denoms[j], Sub(shs[m][0], shs[j][0]))
+                denoms[j] = S2(denoms[j], Sub(xs[m], xs[j]))
     inv_denoms = montgomery_batch_invert(denoms)
-    for j, (xj, yj) in enumerate(shs):
+    ls = []
+    for j in range(k):
         l = inv_denoms[j]
         for m in range(k):
             if m != j:
-                l = S2(l, shs[m][0])  # l_j = ∏_{m≠j} x_m / (x_m - x_j)
-        acc = P(acc, Pm(l, yj))
-    return acc
\ No newline at end of file
+                l = S2(l, xs[m])  # l_j = ∏_{m≠j} x_m / (x_m - x_j)
+        ls.append(l)
+    return ls
+
+def lagrange_packed(xs):
+    # coefficients for sorted(xs), packed for Msm; a repeated quorum is a cache hit
+    xs = sorted(xs)
+    key = hashlib.sha256(b''.join(xs)).digest()
+    return LAGRANGE_CACHE.get(key, lambda: b''.join(lagrange(xs)))
+
+def recon(shs):
+    shs = sorted(shs)
+    return Msm(lagrange_packed([x for x, _ in shs]), b''.join(y for _, y in shs))  # k muls
+
+def repair_shares(available_shares, missing_xs):
+    # Interpolate the k available shares at every missing x at once:
+    # y* = Σ_j M(x*) / ((x* - x_j) w_j) * y_j, with the weights w_j computed once,
+    # one batch inversion for all (x* - x_j) w_j and one multi-row MSM over the y_j
+    xs = [x for x, _ in available_shares]
+    have = dict(available_shares)
+    todo = [x for x in missing_xs if x not in have]
+    out = {}
+    if todo:
+        w = bary_weights(xs)
+        dens, Ms = [], []
+        for xm in todo:
+            Mx = ONE
+            for xj, wj in zip(xs, w):
+                d = Sub(xm, xj)
+                Mx = S2(Mx, d)
+                dens.append(S2(d, wj))
+            Ms.append(Mx)
+        inv, k = montgomery_batch_invert(dens), len(xs)
+        rows = b''.join(S2(Ms[i], inv[i*k + j]) for i in range(len(todo)) for j in range(k))
+        out = dict(zip(todo, unpack(MsmMany(rows, b''.join(y for _, y in available_shares)))))
+    return [(x, have[x] if x in have else out[x]) for x in missing_xs]
+
+class IncrementalRecon:
+    """Reconstruction at 0 from k-1 fixed shares plus one varying share per query."""
+    def __init__(self, fixed):
+        self.fixed = tuple(fixed)
+        self.xs = [x for x, _ in self.fixed]
+        self.lam = lagrange(self.xs)  # coefficients over the fixed set alone
+        self.ys = b''.join(y for _, y in self.fixed)
+        self.prod = ONE
+        for x in self.xs:
+            self.prod = S2(self.prod, x)
+
+    def query(self, sh):
+        # fixed j: lam_j * x/(x - x_j);  new: ∏ x_m/(x_m - x)  -- O(k) scalar ops, one k-term MSM
+        x, y = sh
+        if x in self.xs:
+            return None
+        inv = montgomery_batch_invert([Sub(x, xj) for xj in self.xs])
+        coeffs, l_new = [], self.prod
+        for lj, iv in zip(self.lam, inv):
+            coeffs.append(S2(S2(lj, x), iv))
+            l_new = S2(l_new, iv)
+        if len(self.xs) % 2:
+            l_new = Sub(ZERO, l_new)  # 1/(x_m - x) = -1/(x - x_m)
+        return Msm(b''.join(coeffs) + l_new, self.ys + y)
+
+    def extend(self, shares):
+        # The same object over fixed + shares, reusing this set's weights: O(len(shares) * k)
+        # scalar ops instead of a fresh Lagrange over the whole set.
+        # old j: lam_j * ∏_a a/(a - x_j);  new a: ∏_{m≠a} x_m / ∏_{m≠a}(x_m - a)
+        new = {}
+        for x, y in shares:
+            if x not in self.xs:
+                new.setdefault(x, y)
+        ax = list(new)
+        xs = self.xs + ax
+        pa = ONE
+        for a in ax:
+            pa = S2(pa, a)
+        prod = S2(self.prod, pa)
+        den = []
+        for xj in self.xs:
+            d = ONE
+            for a in ax:
+                d = S2(d, Sub(a, xj))
+            den.append(d)
+        for a in ax:
+            d = a
+            for xm in xs:
+                if xm != a:
+                    d = S2(d, Sub(xm, a))
+            den.append(d)
+        inv = montgomery_batch_invert(den)
+        out = object.__new__(IncrementalRecon)
+        out.fixed = self.fixed + tuple(new.items())
+        out.xs, out.prod = xs, prod
+        out.lam = [S2(S2(l, pa), iv) for l, iv in zip(self.lam, inv)] + [S2(prod, iv) for iv in inv[len(self.xs):]]
+        out.ys = self.ys + b''.join(new.values())
+        return out
+
+class ReconstructionSession:
+    """Online reconstruction: shares are verified on arrival, the secret is ready at the k-th valid one."""
+    def __init__(self, k, T, g, ix=None):
+        self.k, self.T, self.g = k, T, g
+        self.ix = ix or TranscriptIndex(T)
+        self.xs, self.ys = [], []
+        self.w = []      # w_j = ∏_{m≠j}(x_j - x_m) over the accepted shares
+        self.prod = ONE  # ∏ x_m
+        self.rejected = 0
+        self.secret = None
+
+    def _accept(self, x, y):
+        # fold x into the running weights, O(k) scalar ops
+        wn = ONE
+        for j, xj in enumerate(self.xs):
+            d = Sub(xj, x)
+            self.w[j] = S2(self.w[j], d)
+            wn = S2(wn, Sub(ZERO, d))
+        self.xs.append(x)
+        self.ys.append(y)
+        self.w.append(wn)
+        self.prod = S2(self.prod, x)
+        if len(self.xs) == self.k:
+            # l_j = (-1)^(k-1) ∏ x_m / (x_j w_j): one batch inversion and one k-term MSM
+            inv = montgomery_batch_invert([S2(xj, wj) for xj, wj in zip(self.xs, self.w)])
+            c = self.prod if self.k % 2 else Sub(ZERO, self.prod)
+            self.secret = Msm(b''.join(S2(c, iv) for iv in inv), b''.join(self.ys))
+
+    def add(self, sh):
+        if self.secret is None:
+            if sh[0] in self.xs or not ShS(sh, self.T, self.g, self.ix):
+                self.rejected += 1
+            else:
+                self._accept(*sh)
+        return self.secret
+
+    def add_many(self, shares):
+        # batch verification: one shared-table hp_many over the batch
+        shares = [sh for sh in shares if sh[0] not in self.xs]
+        for (x, y), fx in zip(shares, unpack(hp_many([x for x, _ in shares], self.g))):
+            if self.secret is not None:
+                break
+            if x in self.xs or self.ix.match(y, fx) is None:
+                self.rejected += 1
+            else:
+                self._accept(x, y)
+        return self.secret
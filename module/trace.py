@@ -1,78 +1,378 @@
-import random
-from verification import ShS
-from poly_helpers import hp, check
+import random, asyncio, hashlib, struct, os, json, secrets, itertools, copy
+from verification import ShS, TranscriptIndex
+from poly_helpers import hp_cached, check, LRU
 from curve_ops import rho, Sm, cm, B
 from utils import reset, rb_bump, CNT
-from reconstruction import recon
+from reconstruction import IncrementalRecon
 import time
+import utils
+from concurrent.futures import ProcessPoolExecutor
 
-def Trace(tk, T, g, f, t, R, cm):
+RECON_CACHE_SIZE = 16  # IncrementalRecon objects kept per Rbox
+
+_W = {}  # per-worker state, shipped once through the pool initializer
+
+def _trace_init(R, DSH, shv, S):
+    _W.update(R=R, DSH=DSH, shv=shv, S=S)
+
+def _trace_shard(idxs, rng=None):
+    utils.use_stream(rng)
+    R, DSH, shv = _W['R'], _W['DSH'], _W['shv']
+    return [(idx, R(DSH + [shv[idx]])) for idx in idxs]
+
+class QueryLog:
+    """Hash-chained Trace record: the DSH used, then (idx, response) for every query."""
+    def __init__(self, DSH=()):
+        self.start(DSH)
+
+    def start(self, DSH):
+        self.DSH = list(DSH)
+        self.entries = []  # (idx, res, h)
+        self.head = hashlib.sha256(b'TSS-PV trace log' + b''.join(z + pz for z, pz in self.DSH)).digest()
+
+    @staticmethod
+    def link(h, idx, res):
+        return hashlib.sha256(h + struct.pack('>I', idx) + (res or b'\0' * 32)).digest()
+
+    def append(self, idx, res):
+        self.head = self.link(self.head, idx, res)
+        self.entries.append((idx, res, self.head))
+
+    def consistent(self):
+        h = hashlib.sha256(b'TSS-PV trace log' + b''.join(z + pz for z, pz in self.DSH)).digest()
+        for idx, res, hi in self.entries:
+            h = self.link(h, idx, res)
+            if h != hi:
+                return False
+        return h == self.head
+
+    def to_bytes(self):
+        out = [struct.pack('>HI', len(self.DSH), len(self.entries))]
+        out.extend(z + pz for z, pz in self.DSH)
+        out.extend(struct.pack('>IB', idx, res is not None) + (res or b'\0' * 32) for idx, res, _ in self.entries)
+        return b''.join(out) + self.head
+
+    @classmethod
+    def from_bytes(cls, buf):
+        m, n = struct.unpack_from('>HI', buf)
+        off = 6 + 64 * m
+        log = cls([(buf[6+64*i:38+64*i], buf[38+64*i:70+64*i]) for i in range(m)])
+        for i in range(n):
+            idx, ok = struct.unpack_from('>IB', buf, off + 37 * i)
+            log.append(idx, buf[off+37*i+5:off+37*i+37] if ok else None)
+        return log if log.head == buf[off+37*n:] else None
+
+def select_dummy_shares(dsh, shv, t, f, rng=random):
+    # exactly t-f-1 dummy shares with distinct z, none equal to a player x
+    xs = {x for x, _ in shv}
+    pool = list({z: (z, pz) for z, pz in dsh if z not in xs}.values())
+    return rng.sample(pool, t - f - 1)
+
+def Trace(tk, T, g, f, t, R, cm, workers=1, log=None):
     ζ, dsh, shv = tk
     r, s, S = ζ
     n = len(shv)
     I = set(range(n))
     # Select t-f-1 dummy shares
-    DSH = []
-    banned = {x for x, _ in shv}
-    for z, pz in random.sample(dsh, t - f - 1):
-        if z not in banned:
-            DSH.append((z, pz))
-            banned.add(z)
+    DSH = select_dummy_shares(dsh, shv, t, f)
+    if log is not None:
+        log.start(DSH)
+    if workers > 1:
+        step = -(-n // (4 * workers))
+        shards = [range(lo, min(lo + step, n)) for lo in range(0, n, step)]
+        with ProcessPoolExecutor(workers, initializer=_trace_init, initargs=(R, DSH, shv, S)) as ex:
+            for part in ex.map(_trace_shard, shards, [utils.substream(f'trace{s.start}') for s in shards]):
+                for idx, res in part:
+                    if log is not None:
+                        log.append(idx, res)
+                    if res == S:
+                        I.discard(idx)
+        return sorted(I), [shv[i] for i in I]
     for idx, sh in enumerate(shv):
-        if R(DSH + [sh]) == S:
+        res = R(DSH + [sh])
+        if log is not None:
+            log.append(idx, res)
+        if res == S:
             I.discard(idx)
     return sorted(I), [shv[i] for i in I]
 
-def TrVer(vk, I, T, π, g, f, t, R, cm):
+def trace_adaptive(tk, T, g, f, t, R, cm, bound=None, order=()):
+    # Query candidates in `order` first (e.g. shares seen in leaks or prior traces), then
+    # the rest; stop once `bound` (default f, the most a coalition can embed) are accused
+    ζ, dsh, shv = tk
+    S, n = ζ[2], len(shv)
+    bound = f if bound is None else bound
+    first = list(dict.fromkeys(order))
+    if any(not 0 <= i < n for i in first):
+        raise ValueError("order index out of range")
+    DSH = select_dummy_shares(dsh, shv, t, f)
+    seen = set(first)
+    I, q = [], 0
+    for idx in itertools.chain(first, (i for i in range(n) if i not in seen)):
+        q += 1
+        if R(DSH + [shv[idx]]) != S:
+            I.append(idx)
+            if len(I) >= bound:
+                break
+    I.sort()
+    return I, [shv[i] for i in I], dict(queries=q, saved=n - q)
+
+# ────────── Streaming Trace ──────────
+def write_shares(path, shares):
+    # fixed 64-byte records: x || y
+    with open(path, 'wb') as fh:
+        for x, y in shares:
+            fh.write(x + y)
+
+def read_shares(path, start=0):
+    with open(path, 'rb') as fh:
+        fh.seek(64 * start)
+        while rec := fh.read(64):
+            yield rec[:32], rec[32:]
+
+def sample_stream(items, m, rng):
+    # reservoir sample of m items from any iterable, O(m) memory
+    res = []
+    for i, it in enumerate(items):
+        if i < m:
+            res.append(it)
+        elif (j := rng.randrange(i + 1)) < m:
+            res[j] = it
+    return res
+
+def _save_checkpoint(path, state):
+    with open(path + '.tmp', 'w') as fh:
+        json.dump(state, fh)
+    os.replace(path + '.tmp', path)
+
+def trace_stream(ζ, dsh, shares, f, t, R, checkpoint=None, every=256, seed=None, progress=print):
+    # Trace over a share iterator or a share file with bounded memory. Every `every`
+    # queries the next index, the accused so far and the DSH seed go to `checkpoint`;
+    # an existing checkpoint is resumed from there with the same DSH, once the dealing
+    # (S and dsh) and the shares already consumed are checked against its digests.
+    S, m = ζ[2], t - f - 1
+    state = dict(seed=seed if seed is not None else secrets.randbits(64), next=0, accused=[], dropped=[])
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as fh:
+            state = json.load(fh)
+    hd = hashlib.sha256(S)
+    def hashed(items):
+        for z, pz in items:
+            hd.update(z + pz)
+            yield z, pz
+    # twice the dummies needed: spares stand in for any whose z is a player x
+    cand = sample_stream(hashed(dsh), 2 * m, random.Random(state['seed']))
+    if state.setdefault('dealing', hd.hexdigest()) != hd.hexdigest():
+        raise ValueError("checkpoint is for another dealing")
+    bad = {bytes.fromhex(z) for z in state['dropped']}
+    if isinstance(shares, (str, os.PathLike)):
+        zs = {z for z, _ in cand}
+        bad |= {x for x, _ in read_shares(shares) if x in zs}
+        it = read_shares(shares)
+    else:
+        it = iter(shares)
+
+    def pick():
+        DSH = [c for c in cand if c[0] not in bad][:m]
+        if len(DSH) < m:
+            raise ValueError("too few dummy shares apart from player abscissas")
+        return DSH, {z for z, _ in DSH}
+    DSH, dz = pick()
+    hs = hashlib.sha256()
+    for _, (x, y) in zip(range(state['next']), it):
+        hs.update(x + y)
+    if state['next'] and hs.hexdigest() != state.get('prefix'):
+        raise ValueError("checkpoint is for another share source")
+
+    def save():
+        state['prefix'] = hs.hexdigest()
+        _save_checkpoint(checkpoint, state)
+    t0, done = time.perf_counter(), 0
+    for idx, sh in enumerate(it, state['next']):
+        if sh[0] in dz:
+            # a dummy is this player's share: swap it for a spare and recheck what it may have failed
+            bad.add(sh[0])
+            state['dropped'].append(sh[0].hex())
+            DSH, dz = pick()
+            state['accused'] = [a for a in state['accused']
+                                if R(DSH + [(bytes.fromhex(a[1]), bytes.fromhex(a[2]))]) != S]
+        if R(DSH + [sh]) != S:
+            state['accused'].append([idx, sh[0].hex(), sh[1].hex()])
+        hs.update(sh[0] + sh[1])
+        state['next'], done = idx + 1, done + 1
+        if done % every == 0:
+            if checkpoint:
+                save()
+            if progress:
+                progress(f"[Trace ] {state['next']:7d} shares {done / (time.perf_counter() - t0):7.1f} q/s |I|={len(state['accused'])}")
+    if checkpoint:
+        save()
+    return [a[0] for a in state['accused']], [(bytes.fromhex(a[1]), bytes.fromhex(a[2])) for a in state['accused']]
+
+def _trver_checks(vk, I, T, π, g, cm):
     ζ, dsh, shv = vk
     r, s, S = ζ
     # Check zeta and cm consistency
     if any(t[7] != cm for t in T):  # Use cm field (index 7)
         return 0
     # Check sh_i in shv
-    if not all(sh in shv for sh in π):
+    shv_set = set(shv)
+    if not all(sh in shv_set for sh in π):
         return 0
     # Verify px_i, pz_i consistency
     for x, px in shv:
-        fx = hp(x, g)
+        fx = hp_cached(x, g)
         if px != rho(fx, r, s):
             return 0
     for z, pz in dsh:
-        fz = hp(z, g)
+        fz = hp_cached(z, g)
         if pz != rho(fz, r, s):
             return 0
-    # Select t-f-1 dummy shares
-    DSH = []
-    banned = {x for x, _ in shv}
-    for z, pz in random.sample(dsh, t - f - 1):
-        if z not in banned:
-            DSH.append((z, pz))
-            banned.add(z)
-    # Check faulty shares
+    # Check faulty shares are transcript rows
+    ix = TranscriptIndex(T)
     for idx in I:
         x, y = shv[idx]
-        if not any((y == px_j and hp(x, g) == fx_j) or (y == pz_j and hp(x, g) == fz_j) for fx_j, fz_j, px_j, pz_j, _, _, _, _ in T):
+        if ix.match(y, hp_cached(x, g)) is None:
             return 0
-        if R(DSH + [shv[idx]]) == S:
+    return 1
+
+def _trver_log(vk, I, log, f, t, R, sample):
+    # Replay-free check of a Trace log: chain, DSH, coverage and verdicts,
+    # then re-query R on the accused indices plus `sample` random others
+    ζ, dsh, shv = vk
+    if not log.consistent() or len({z for z, _ in log.DSH}) != len(log.DSH) or len(log.DSH) != t - f - 1:
+        return 0
+    xs = {x for x, _ in shv}
+    if not set(log.DSH) <= set(dsh) or any(z in xs for z, _ in log.DSH):
+        return 0
+    if sorted(idx for idx, _, _ in log.entries) != list(range(len(shv))):
+        return 0
+    # an honest DSH lets every non-traitor query decrypt; all-None is a framing attempt
+    if all(res is None for _, res, _ in log.entries):
+        return 0
+    if sorted(I) != sorted(idx for idx, res, _ in log.entries if res != ζ[2]):
+        return 0
+    Iset = set(I)
+    rest = [e for e in log.entries if e[0] not in Iset]
+    checks = [e for e in log.entries if e[0] in Iset]
+    checks += rest if sample is None else random.sample(rest, min(sample, len(rest)))
+    return int(all(R(log.DSH + [shv[idx]]) == res for idx, res, _ in checks))
+
+def TrVer(vk, I, T, π, g, f, t, R, cm, log=None, sample=None):
+    ζ, dsh, shv = vk
+    if not _trver_checks(vk, I, T, π, g, cm):
+        return 0
+    if log is not None:
+        return _trver_log(vk, I, log, f, t, R, sample)
+    # Select t-f-1 dummy shares
+    DSH = select_dummy_shares(dsh, shv, t, f)
+    # Check faulty shares
+    for idx in I:
+        if R(DSH + [shv[idx]]) == ζ[2]:
             return 0
     return 1
 
-def Rbox(k, embeds, T, g, cm):
-    def R(shares):
+def trace_many(tk, T, g, f, t, boxes, cm):
+    # Trace several decoders of one dealing with one DSH. The DSH is verified once and its
+    # Lagrange weights are computed once; each Rbox works on a copy that trusts the DSH and
+    # only folds its own embeds into those weights. The caller's boxes are left untouched.
+    ζ, dsh, shv = tk
+    S = ζ[2]
+    t0, c0 = time.perf_counter(), utils.CNT
+    DSH = select_dummy_shares(dsh, shv, t, f)
+    ix = TranscriptIndex(T)
+    if not all(ShS(sh, T, g, ix) for sh in DSH):
+        raise ValueError("dummy shares do not verify against T")
+    base = IncrementalRecon(DSH) if DSH else None
+    boxes = list(boxes)
+    for b, box in enumerate(boxes):
+        if isinstance(box, Rbox):
+            boxes[b] = box = copy.copy(box)
+            box.ix, box.verified, box.recons, box.base = ix, box.verified | set(DSH), LRU(RECON_CACHE_SIZE), base
+    report = dict(setup_ms=1e3 * (time.perf_counter() - t0), setup_mul=utils.CNT - c0,
+                  boxes=[dict(queries=0, ms=0.0, mul=0) for _ in boxes])
+    Is = [set(range(len(shv))) for _ in boxes]
+    for idx, sh in enumerate(shv):  # interleave: every box answers candidate idx in turn
+        for b, box in enumerate(boxes):
+            t0, c0 = time.perf_counter(), utils.CNT
+            if box(DSH + [sh]) == S:
+                Is[b].discard(idx)
+            rep = report['boxes'][b]
+            rep['queries'] += 1
+            rep['ms'] += 1e3 * (time.perf_counter() - t0)
+            rep['mul'] += utils.CNT - c0
+    for key in ('queries', 'ms', 'mul'):
+        report[key] = sum(rep[key] for rep in report['boxes'])
+    caches = [box.recons.stats() for box in boxes if isinstance(box, Rbox)]
+    report['recon_cache'] = {key: sum(c[key] for c in caches) for key in ('hits', 'misses', 'evictions')}
+    return [(sorted(I), [shv[i] for i in I]) for I in Is], report
+
+async def ATrace(tk, T, g, f, t, client, cm):
+    # Trace against an out-of-process decoder; queries are pipelined by client
+    ζ, dsh, shv = tk
+    DSH = select_dummy_shares(dsh, shv, t, f)
+    res = await asyncio.gather(*(client.query(DSH + [sh]) for sh in shv))
+    I = [idx for idx, v in enumerate(res) if v != ζ[2]]
+    return I, [shv[i] for i in I]
+
+async def ATrVer(vk, I, T, π, g, f, t, client, cm):
+    ζ, dsh, shv = vk
+    if not _trver_checks(vk, I, T, π, g, cm):
+        return 0
+    DSH = select_dummy_shares(dsh, shv, t, f)
+    res = await asyncio.gather(*(client.query(DSH + [shv[idx]]) for idx in I))
+    return int(all(v != ζ[2] for v in res))
+
+class Rbox:
+    """Pirate decoder oracle R: embeds plus queried shares, reconstructed once k are valid."""
+    def __init__(self, k, embeds, T, g, cm):
+        self.k, self.embeds, self.T, self.g, self.cm = k, embeds, T, g, cm
+        self.ix = TranscriptIndex(T)
+        self.verified = set()  # shares that already passed ShS
+        self.recons = LRU(RECON_CACHE_SIZE)  # IncrementalRecon keyed by the k-1 fixed shares
+        self.base = None  # optional IncrementalRecon over shares common to many fixed sets
+        self.hits = self.misses = 0
+
+    def invalidate(self, shares=None):
+        # Forget cached ShS verdicts: all of them, or only the given shares
+        if shares is None:
+            self.verified.clear()
+        else:
+            self.verified.difference_update(shares)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, verified=len(self.verified))
+
+    def R(self, shares):
         shares = [shares] if isinstance(shares, tuple) else list(shares)
         all_shares = shares
-        valid_shares = [] + embeds
+        valid_shares = [] + self.embeds
         for x, y in all_shares:
-            if not ShS((x, y), T, g):
-                return None
+            if (x, y) in self.verified:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if not ShS((x, y), self.T, self.g, self.ix):
+                    return None
+                self.verified.add((x, y))
             valid_shares.append((x, y))
         uniq = {}
         [uniq.setdefault(x, y) for x, y in valid_shares]
-        if len(uniq) < k:
+        if len(uniq) < self.k:
             return None
         before, t0 = CNT, time.perf_counter()
-        res = recon(list(uniq.items())[:k])
+        items = list(uniq.items())[:self.k]
+        fixed = tuple(items[:-1])
+        res = self.recons.get(fixed, lambda: self._recon(fixed)).query(items[-1])
         rb_bump(CNT - before)
         globals().__setitem__("RB_TIME", globals().get("RB_TIME", 0.0) + (time.perf_counter() - t0))
         return res
-    return R
\ No newline at end of file
+
+    def _recon(self, fixed):
+        # extend the shared base when it covers part of this fixed set, else start afresh
+        common = set(self.base.fixed) if self.base is not None else ()
+        if common and common <= set(fixed):
+            return self.base.extend(sh for sh in fixed if sh not in common)
+        return IncrementalRecon(fixed)
+
+    __call__ = R
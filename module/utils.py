@@ -1,4 +1,4 @@
-import secrets, time, gc, tracemalloc
+import os, hashlib, threading, contextlib, time, gc, tracemalloc
 
 # Start heap tracing
 tracemalloc.start()
@@ -20,9 +20,9 @@ def E(v):
 CNT = RB_CNT = 0
 RB_TIME = 0.0
 
-def bump():
+def bump(d=1):
     global CNT
-    CNT += 1
+    CNT += d
 
 def rb_bump(d):
     global RB_CNT
@@ -37,5 +37,90 @@ def rb_reset():
     RB_CNT = 0
     RB_TIME = 0.0
 
+# Split a packed buffer into 32-byte points/scalars
+def unpack(buf, w=32):
+    return [buf[i:i+w] for i in range(0, len(buf), w)]
+
+# ────────── Randomness ──────────
+# rand() hands out 32-byte slices of a buffer refilled RAND_CHUNK bytes at a time from
+# os.urandom, or, after seed(s), from a SHAKE-256 counter DRBG keyed by (sha256(s), stream).
+# A forked child drops the parent's buffer; in seeded mode it also moves to its own
+# stream "<parent>/<fork no.>", so pool workers never replay each other's values.
+# Process-pool tasks get reproducible streams under any start method: the parent
+# passes substream(label) with each task and the worker calls use_stream(token).
+RAND_CHUNK = 1 << 14
+_rng = dict(key=None, stream=b'0', ctr=0, forks=0, buf=b'', off=0)
+_rng_lock = threading.Lock()
+
+def _seed_key(s):
+    if isinstance(s, int):
+        s = b'i' + str(s).encode()
+    elif isinstance(s, str):
+        s = b's' + s.encode()
+    elif isinstance(s, (bytes, bytearray)):
+        s = b'b' + bytes(s)
+    else:
+        raise TypeError(f"seed must be int, str or bytes, not {type(s).__name__}")
+    return hashlib.sha256(s).digest()
+
+def seed(s=None, stream=0):
+    """Deterministic rand() from seed s (int/str/bytes); seed(None) goes back to the OS."""
+    key = None if s is None else _seed_key(s)
+    with _rng_lock:
+        _rng.update(key=key, stream=str(stream).encode(), ctr=0, forks=0, buf=b'', off=0)
+
+def substream(label):
+    # parent side: token naming an independent stream for one pool task; None when unseeded
+    with _rng_lock:
+        if _rng['key'] is None:
+            return None
+        return _rng['key'], b'%b/%b' % (_rng['stream'], str(label).encode())
+
+def use_stream(token):
+    # worker side: draw from the stream a substream() token names (None: the OS source)
+    key, stream = token or (None, b'0')
+    with _rng_lock:
+        _rng.update(key=key, stream=stream, ctr=0, forks=0, buf=b'', off=0)
+
+@contextlib.contextmanager
+def seeded(s, stream=0):
+    # seed(s, stream) for the duration of a with-block, then back to the previous source
+    with _rng_lock:
+        prev = dict(_rng)
+    seed(s, stream)
+    try:
+        yield
+    finally:
+        with _rng_lock:
+            _rng.update(prev, buf=b'', off=0)
+
+def _refill():
+    if _rng['key'] is None:
+        return os.urandom(RAND_CHUNK)
+    h = hashlib.shake_256(b'%b|%b|%d' % (_rng['key'], _rng['stream'], _rng['ctr']))
+    _rng['ctr'] += 1
+    return h.digest(RAND_CHUNK)
+
 def rand():
-    return secrets.token_bytes(32)
\ No newline at end of file
+    with _rng_lock:
+        off = _rng['off']
+        if off + 32 > len(_rng['buf']):
+            _rng['buf'], off = _refill(), 0
+        _rng['off'] = off + 32
+        return _rng['buf'][off:off+32]
+
+def _before_fork():
+    _rng_lock.acquire()
+    _rng['forks'] += 1
+
+def _after_fork_parent():
+    _rng_lock.release()
+
+def _after_fork_child():
+    global _rng_lock
+    _rng_lock = threading.Lock()
+    _rng.update(stream=b'%b/%d' % (_rng['stream'], _rng['forks']), ctr=0, forks=0, buf=b'', off=0)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_parent,
+                        after_in_child=_after_fork_child)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from poly_helpers import hp, check
+from poly_helpers import hp_cached, check
 def ShD(T, cm):
     # Check cm consistency
     if any(t[7] != cm for t in T):  # Use cm field (index 7)
@@ -9,7 +9,24 @@ def ShD(T, cm):
             return 0
     return 1
 
-def ShS(sh, T, g):
+class TranscriptIndex:
+    """Maps px/pz and fx/fz of a transcript T to (row, 'x' | 'z'), built once per T."""
+    def __init__(self, T):
+        self.p, self.f = {}, {}
+        for i, (fx_i, fz_i, px_i, pz_i, _, _, _, _) in enumerate(T):
+            self.p[px_i], self.p[pz_i] = (i, 'x'), (i, 'z')
+            self.f[fx_i], self.f[fz_i] = (i, 'x'), (i, 'z')
+
+    def match(self, y, fx):
+        # (row, kind) with f-column fx and p-column y, else None
+        hit = self.p.get(y)
+        return hit if hit is not None and self.f.get(fx) == hit else None
+
+def ShS(sh, T, g, ix=None):
     x, y = sh
-    fx = hp(x, g)
-    return int(any((fx == fx_j and y == px_j) or (fx == fz_j and y == pz_j) for fx_j, fz_j, px_j, pz_j, _, _, _, _ in T))
\ No newline at end of file
+    fx = hp_cached(x, g)
+    if ix is None:
+        # one-off check: a linear scan beats building a 2n-entry index for a single lookup
+        return int(any((fx == fx_j and y == px_j) or (fx == fz_j and y == pz_j)
+                       for fx_j, fz_j, px_j, pz_j, _, _, _, _ in T))
+    return int(ix.match(y, fx) is not None)
\ No newline at end of file